@@ -1,16 +1,15 @@
 """A task splitting a text file into multiple parts with a specified size"""
 
 from collections import OrderedDict
-from io import BytesIO
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from math import sqrt
 from pathlib import Path
-from shutil import move
 from tempfile import TemporaryDirectory
 from warnings import simplefilter
 
 import requests
-from cmem.cmempy.api import config, get_access_token
+from cmem.cmempy.api import config
 from cmem.cmempy.workspace.projects.resources.resource import (
-    create_resource,
     delete_resource,
     get_resource_uri,
 )
@@ -25,15 +24,22 @@ from cmem_plugin_base.dataintegration.types import (
     StringParameterType,
 )
 from cmem_plugin_base.dataintegration.utils import setup_cmempy_user_access
-from filesplit.split import Split
 from pathvalidate import is_valid_filepath
+from requests import PreparedRequest
+from requests.adapters import HTTPAdapter
 from urllib3.exceptions import InsecureRequestWarning
 
 from cmem_plugin_splitfile.doc import SPLITFILE_DOC
 from cmem_plugin_splitfile.resource_parameter_type import ResourceParameterType
+from cmem_plugin_splitfile.splitter import Splitter
+from cmem_plugin_splitfile.utils import advise_dontneed, move_file
 
 simplefilter("ignore", category=InsecureRequestWarning)
 
+UPLOAD_WORKERS = 4
+CANCEL_CHECK_INTERVAL = 16
+AUTO_CHUNK_SIZE_MAX = 67108864
+
 
 @Plugin(
     label="Split file",
@@ -97,6 +103,16 @@ simplefilter("ignore", category=InsecureRequestWarning)
             default_value="/data/datalake",
             advanced=True,
         ),
+        PluginParameter(
+            param_type=BoolParameterType(),
+            name="auto_chunk_size",
+            label="Automatic chunk size",
+            description="""Increase the chunk size for large input files to limit the number of
+            generated files. The chunk size is raised to 1000 times the square root of the input
+            file size in bytes, up to 64 MB. Has no effect when splitting by lines.""",
+            default_value=False,
+            advanced=True,
+        ),
     ],
 )
 class SplitFilePlugin(WorkflowPlugin):
@@ -111,6 +127,7 @@ class SplitFilePlugin(WorkflowPlugin):
         delete_file: bool = False,
         use_directory: bool = False,
         projects_path: str = "/data/datalake",
+        auto_chunk_size: bool = False,
     ) -> None:
         errors = ""
         if not is_valid_filepath(input_filename):
@@ -149,10 +166,11 @@ class SplitFilePlugin(WorkflowPlugin):
         self.include_header = include_header
         self.delete_file = delete_file
         self.use_directory = use_directory
+        self.auto_chunk_size = auto_chunk_size
         self.input_ports = FixedNumberOfInputs([])
         self.output_port = None
         self.moved_files = 0
-        self.split_filenames: list[str] = []
+        self.split_filenames: list[Path] = []
 
     def cancel_workflow(self) -> bool:
         """Cancel workflow"""
@@ -161,66 +179,106 @@ class SplitFilePlugin(WorkflowPlugin):
             return True
         return False
 
-    def split_file(self, input_file_path: Path) -> None:
-        """Split file"""
-        split = Split(inputfile=str(input_file_path), outputdir=self.temp)
-        split.splitzerofill = 9
+    def split_file(self, input_file_path: Path, keep_input: bool = True) -> None:
+        """Split file
+
+        If the input file is not kept after splitting, a single part may be a hard link to it.
+        """
+        size = self.size
+        if self.auto_chunk_size and not self.lines:
+            auto_size = int(1000 * sqrt(input_file_path.stat().st_size))
+            size = max(size, min(auto_size, AUTO_CHUNK_SIZE_MAX))
+            self.log.info(f"Using chunk size of {size} bytes")
+        splitter = Splitter(inputfile=input_file_path, outputdir=Path(self.temp))
         if self.lines:
-            split.bylinecount(
+            splitter.bylinecount(
                 linecount=self.size,
                 includeheader=self.include_header,
                 callback=self.split_callback,
             )
         else:
-            split.bysize(
-                size=self.size,
-                newline=True,
+            splitter.bysize(
+                size=size,
                 includeheader=self.include_header,
                 callback=self.split_callback,
+                link_single_part=not keep_input,
             )
 
     def split_callback(self, file_path: str, file_size: int) -> None:
         """Add split files to list"""
-        self.log.info(f"File {Path(file_path).name} generated ({file_size} bytes)")
-        self.split_filenames.append(file_path)
+        part_path = Path(file_path)
+        self.log.info(f"File {part_path.name} generated ({file_size} bytes)")
+        self.split_filenames.append(part_path)
 
     def get_file(self, file_path: Path) -> None:
         """Stream resource to temp folder"""
         resource_url = get_resource_uri(
             project_name=self.context.task.project_id(), resource_name=self.input_filename
         )
-        setup_cmempy_user_access(self.context.user)
-        headers = {
-            "Authorization": f"Bearer {get_access_token()}",
-            "User-Agent": config.get_cmem_user_agent(),
-        }
-        with requests.get(resource_url, headers=headers, stream=True) as r:  # noqa: S113
+        with self.session.get(resource_url, stream=True) as r:
             r.raise_for_status()
+            # scale the buffer with the file size: less memory for small files, fewer
+            # iterations for large ones
+            content_length = int(r.headers.get("Content-Length", 0))
+            chunk_size = min(max(content_length, 65536), 16777216) if content_length else 10485760
             with file_path.open("wb") as f:
-                for chunk in r.iter_content(chunk_size=10485760):
+                for chunk in r.iter_content(chunk_size=chunk_size):
                     f.write(chunk)
 
+    def upload_file(self, part_path: Path) -> None:
+        """Upload split file to the project resources"""
+        resource_url = get_resource_uri(
+            project_name=self.context.task.project_id(),
+            resource_name=str(Path(self.input_filename).parent / part_path.name),
+        )
+        with part_path.open("rb") as f:
+            self.session.put(resource_url, data=f).raise_for_status()
+            advise_dontneed(f.fileno())
+
+    def bearer_auth(self, request: PreparedRequest) -> PreparedRequest:
+        """Add the current access token of the user to a request"""
+        # the token may expire during long running splits and uploads, so it is
+        # refreshed for every request, as cmempy does
+        request.headers["Authorization"] = f"Bearer {self.context.user.token()}"
+        return request
+
+    def upload_parts(self) -> bool:
+        """Upload the split files with up to UPLOAD_WORKERS concurrent requests
+
+        The workflow status is checked before each upload is submitted. Returns False if the
+        workflow was cancelled.
+        """
+        futures: list[Future] = []
+        pending: set[Future] = set()
+        try:
+            with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+                for part_path in self.split_filenames:
+                    if self.cancel_workflow():
+                        return False
+                    if len(pending) == UPLOAD_WORKERS:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()  # stop at the first failed upload
+                    futures.append(executor.submit(self.upload_file, part_path))
+                    pending.add(futures[-1])
+                for future in pending:
+                    future.result()
+        finally:
+            # uploads still running on return or error are waited for, count all that succeeded
+            self.moved_files = sum(1 for f in futures if not f.cancelled() and not f.exception())
+        return True
+
     def execute_api(self) -> bool:
         """Execute plugin using the API"""
+        self.session.auth = self.bearer_auth
+        self.session.headers["User-Agent"] = config.get_cmem_user_agent()
         file_path = Path(self.temp) / Path(self.input_filename).name
         self.get_file(file_path)
         if self.cancel_workflow():
             return False
-        self.split_file(file_path)
-
-        for filename in self.split_filenames:
-            if self.cancel_workflow():
-                return False
-            with Path(filename).open("rb") as f:
-                buf = BytesIO(f.read())
-                setup_cmempy_user_access(self.context.user)
-                create_resource(
-                    project_name=self.context.task.project_id(),
-                    resource_name=str(Path(self.input_filename).parent / Path(filename).name),
-                    file_resource=buf,
-                    replace=True,
-                )
-                self.moved_files += 1
+        self.split_file(file_path, keep_input=False)
+        if not self.upload_parts():
+            return False
 
         if self.delete_file:
             setup_cmempy_user_access(self.context.user)
@@ -230,16 +288,15 @@ class SplitFilePlugin(WorkflowPlugin):
     def execute_filesystem(self) -> bool:
         """Execute plugin using file system"""
         resources_path = self.projects_path / self.context.task.project_id() / "resources"
-        self.split_file(resources_path / self.input_filename)
-        input_file_parent = Path(self.input_filename).parent
-        if str(input_file_parent) != ".":
-            resources_path /= input_file_parent
-            resources_path.mkdir(exist_ok=True)
+        self.split_file(resources_path / self.input_filename, keep_input=not self.delete_file)
+        target_path = resources_path / Path(self.input_filename).parent
+        target_path.mkdir(exist_ok=True)
 
-        for filename in self.split_filenames:
-            if self.cancel_workflow():
+        # moving is a cheap rename, so the workflow status is only polled every few files
+        for index, part_path in enumerate(self.split_filenames):
+            if index % CANCEL_CHECK_INTERVAL == 0 and self.cancel_workflow():
                 return False
-            move(Path(filename), resources_path / Path(filename).name)
+            move_file(part_path, target_path / part_path.name)
             self.moved_files += 1
 
         if self.delete_file:
@@ -257,7 +314,19 @@ class SplitFilePlugin(WorkflowPlugin):
             )
             return
 
-        with TemporaryDirectory() as self.temp:
+        # keep the parts on the same filesystem as the project resources, so they can be renamed
+        temp_parent = (
+            str(self.projects_path / context.task.project_id()) if self.use_directory else None
+        )
+        with (
+            TemporaryDirectory(prefix=".splitfile_", dir=temp_parent) as self.temp,
+            requests.Session() as self.session,
+        ):
+            # one connection per upload thread, reused for all requests of this execution
+            adapter = HTTPAdapter(pool_maxsize=UPLOAD_WORKERS)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+            self.session.verify = config.get_ssl_verify()
             finished = self.execute_filesystem() if self.use_directory else self.execute_api()
 
         operation_desc = "file generated" if self.moved_files == 1 else "files generated"
@@ -0,0 +1,204 @@
+"""Split a text file at line boundaries using kernel-side copies"""
+
+import mmap
+import os
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from cmem_plugin_splitfile.utils import (
+    O_BINARY,
+    advise_dontneed,
+    advise_sequential,
+    copy_range,
+    has_positional_read,
+)
+
+SPLIT_ZERO_FILL = 9
+LINE_SCAN_BLOCK = 1048576
+COPY_WORKERS = min(4, os.cpu_count() or 1)
+MAX_PENDING_PARTS = 2 * COPY_WORKERS
+
+
+def _line_end(mm: mmap.mmap, start: int) -> int:
+    """Return the offset after the line starting at the given offset"""
+    index = mm.find(b"\n", start)
+    return len(mm) if index == -1 else index + 1
+
+
+def _skip_lines(mm: mmap.mmap, start: int, count: int) -> int:
+    """Return the offset after `count` lines from the given offset, or the file size"""
+    pos = start
+    while pos < len(mm):
+        block = mm[pos : pos + LINE_SCAN_BLOCK]
+        newlines = block.count(b"\n")
+        if newlines < count:
+            count -= newlines
+            pos += len(block)
+            continue
+        index = -1
+        for _ in range(count):
+            index = block.find(b"\n", index + 1)
+        return pos + index + 1
+    return len(mm)
+
+
+class Splitter:
+    """Split a text file into parts without breaking lines
+
+    The input file is memory-mapped to find the cut offsets: by size, the last line break
+    before the size limit is searched backwards, so only the end of each part is scanned; by
+    line count, line breaks are counted blockwise. The parts are then copied from the input
+    file with kernel-side copies.
+    """
+
+    def __init__(self, inputfile: Path, outputdir: Path) -> None:
+        self.inputfile = inputfile
+        self.outputdir = outputdir
+        # the part paths only differ in the number, build the rest once
+        self._part_prefix = f"{outputdir / inputfile.stem}_"
+        self._part_suffix = inputfile.suffix
+
+    def _part_path(self, splitnum: int) -> Path:
+        """Return the path of the part with the given number"""
+        return Path(f"{self._part_prefix}{splitnum:0{SPLIT_ZERO_FILL}d}{self._part_suffix}")
+
+    def _link_part(self) -> Path | None:
+        """Create the first part as a hard link to the input file, return None if not possible"""
+        part_path = self._part_path(1)
+        try:
+            os.link(self.inputfile, part_path)
+        except OSError:
+            return None  # e.g. different filesystems
+        return part_path
+
+    def _write_part(self, fd: int, splitnum: int, header: bytes, start: int, end: int) -> Path:
+        """Write the header and the byte range [start, end) of the input file to a new part"""
+        part_path = self._part_path(splitnum)
+        out_fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY, 0o644)
+        # without pread the copy moves the file position, so each part reads from its own fd
+        in_fd = fd if has_positional_read() else os.open(self.inputfile, os.O_RDONLY | O_BINARY)
+        try:
+            if header:
+                os.write(out_fd, header)
+            copy_range(in_fd, out_fd, start, end - start)
+        finally:
+            os.close(out_fd)
+            if in_fd != fd:
+                os.close(in_fd)
+        # the input is read only once, do not keep the copied range cached
+        advise_dontneed(fd, start, end - start)
+        return part_path
+
+    def _ranges(
+        self, mm: mmap.mmap, find_cut: Callable[[mmap.mmap, int, int], int], start: int
+    ) -> Iterator[tuple[int, int]]:
+        """Yield the byte ranges of the parts, the header is the input before `start`"""
+        pos = start
+        while True:
+            cut = find_cut(mm, pos, start)
+            yield pos, cut
+            if cut >= len(mm):
+                return
+            pos = cut
+
+    def _write_parts(
+        self,
+        fd: int,
+        header: bytes,
+        ranges: Iterable[tuple[int, int]],
+        callback: Callable[[str, int], None] | None,
+    ) -> None:
+        """Write the parts concurrently while further ranges are determined
+
+        The kernel-side copies do not hold the GIL, so the parts are written by a thread pool.
+        At most MAX_PENDING_PARTS parts are queued, the callback is called in part order.
+        """
+        pending: deque[tuple[Future[Path], int]] = deque()
+
+        def finish_part() -> None:
+            future, size = pending.popleft()
+            part_path = future.result()
+            if callback:
+                callback(str(part_path), size)
+
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            for splitnum, (start, end) in enumerate(ranges, 1):
+                future = executor.submit(self._write_part, fd, splitnum, header, start, end)
+                pending.append((future, len(header) + end - start))
+                if len(pending) > MAX_PENDING_PARTS:
+                    finish_part()
+            while pending:
+                finish_part()
+
+    def _split(
+        self,
+        find_cut: Callable[[mmap.mmap, int, int], int],
+        includeheader: bool,
+        callback: Callable[[str, int], None] | None,
+    ) -> None:
+        """Split the input file at the offsets returned by `find_cut`
+
+        `find_cut` is called with the mapped input file, the start offset of the next part and
+        the header size, and returns the end offset of that part.
+        """
+        fd = os.open(self.inputfile, os.O_RDONLY | O_BINARY)
+        try:
+            if not os.fstat(fd).st_size:
+                # an empty file cannot be mapped, it results in one empty part
+                self._write_parts(fd, b"", [(0, 0)], callback)
+                return
+            advise_sequential(fd)
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                header_size = _line_end(mm, 0) if includeheader else 0
+                ranges = self._ranges(mm, find_cut, header_size)
+                self._write_parts(fd, mm[:header_size], ranges, callback)
+        finally:
+            os.close(fd)
+
+    def bysize(
+        self,
+        size: int,
+        includeheader: bool = False,
+        callback: Callable[[str, int], None] | None = None,
+        link_single_part: bool = False,
+    ) -> None:
+        """Split the input file into parts of at most `size` bytes
+
+        Each part consists of complete lines. A line longer than the size limit is written to a
+        part of its own. If `includeheader` is set, the first line of the input file is written
+        to the beginning of each part and counts towards the part size.
+
+        If `link_single_part` is set and the input file fits into a single part, that part is
+        created as a hard link to the input file instead of a copy. This is only safe if the
+        input file is not modified afterwards.
+        """
+        if link_single_part and not includeheader and self.inputfile.stat().st_size <= size:
+            part_path = self._link_part()
+            if part_path:
+                if callback:
+                    callback(str(part_path), part_path.stat().st_size)
+                return
+
+        def find_cut(mm: mmap.mmap, pos: int, header_size: int) -> int:
+            limit = max(size - header_size, 1)
+            if len(mm) - pos <= limit:
+                return len(mm)
+            return mm.rfind(b"\n", pos, pos + limit) + 1 or _line_end(mm, pos)
+
+        self._split(find_cut, includeheader, callback)
+
+    def bylinecount(
+        self,
+        linecount: int,
+        includeheader: bool = False,
+        callback: Callable[[str, int], None] | None = None,
+    ) -> None:
+        """Split the input file into parts of at most `linecount` lines
+
+        If `includeheader` is set, the first line of the input file is written to the beginning
+        of each part and counts towards the line count.
+        """
+        lines = max(linecount - 1, 1) if includeheader else linecount
+        self._split(lambda mm, pos, _: _skip_lines(mm, pos, lines), includeheader, callback)
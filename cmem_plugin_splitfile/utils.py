@@ -0,0 +1,118 @@
+"""utils"""
+
+import os
+import threading
+from errno import EINVAL, ENOSYS, ENOTSOCK, EOPNOTSUPP, EXDEV
+from pathlib import Path
+
+COPY_FALLBACK_ERRNOS = (EINVAL, ENOSYS, ENOTSOCK, EOPNOTSUPP, EXDEV)
+COPY_BUFFER_SIZE = 1048576
+# os.open uses text mode on Windows, which would translate line endings on write
+O_BINARY = getattr(os, "O_BINARY", 0)
+
+_copy_buffers = threading.local()
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def _copy_buffer() -> memoryview:
+    # reuse one buffer per thread instead of allocating a new bytes object for every block
+    buffer = getattr(_copy_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _copy_buffers.buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+    return buffer
+
+
+def _pread_write(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    buffer = _copy_buffer()
+    read = os.preadv(src_fd, [buffer[:count]], offset)
+    return os.write(dst_fd, buffer[:read])
+
+
+def _seek_read_write(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    buffer = _copy_buffer()
+    with open(src_fd, "rb", buffering=0, closefd=False) as src:
+        src.seek(offset)
+        read = src.readinto(buffer[:count])
+    return os.write(dst_fd, buffer[:read])
+
+
+def has_positional_read() -> bool:
+    """Return whether copy_range leaves the file position of the source file unchanged
+
+    Without pread (Windows), the last copy fallback seeks the source file descriptor, so
+    it must not be shared between threads.
+    """
+    return hasattr(os, "preadv")
+
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+    """Copy a byte range of the source file to the current position of the destination file
+
+    Uses copy_file_range(2) or, where the kernel or filesystem does not support it,
+    sendfile(2), so that the data does not pass through user space. Falls back to
+    pread/write if neither is available, or to seek/read/write where pread is not
+    available either (see has_positional_read).
+    """
+    copy_functions = [
+        function
+        for name, function in (("copy_file_range", _copy_file_range), ("sendfile", _sendfile))
+        if hasattr(os, name)
+    ]
+    copy_functions.append(_pread_write if has_positional_read() else _seek_read_write)
+    while count > 0:
+        try:
+            copied = copy_functions[0](src_fd, dst_fd, offset, count)
+        except OSError as exc:
+            if exc.errno not in COPY_FALLBACK_ERRNOS or len(copy_functions) == 1:
+                raise
+            copy_functions.pop(0)
+            continue
+        if copied == 0:
+            raise EOFError(f"Unexpected end of file at offset {offset}.")
+        offset += copied
+        count -= copied
+
+
+def advise_sequential(fd: int) -> None:
+    """Advise the kernel that the file will be read sequentially (no-op where unsupported)"""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
+def advise_dontneed(fd: int, offset: int = 0, length: int = 0) -> None:
+    """Advise the kernel to drop the cached pages of a file range (no-op where unsupported)
+
+    A length of 0 means up to the end of the file.
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+
+def move_file(src: Path, dst: Path) -> None:
+    """Move a file, replacing an existing destination file
+
+    Within the same filesystem this is a rename. Otherwise the content is copied with
+    copy_range and the source file is removed.
+    """
+    try:
+        src.replace(dst)
+    except OSError as exc:
+        if exc.errno != EXDEV:
+            raise
+        src_fd = os.open(src, os.O_RDONLY | O_BINARY)
+        try:
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY, 0o644)
+            try:
+                copy_range(src_fd, dst_fd, 0, os.fstat(src_fd).st_size)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+        src.unlink()
@@ -1,207 +1,353 @@
 """Plugin tests."""
 
+import time
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
-from filecmp import cmp
-from io import BytesIO
+from functools import partial
+from itertools import count
 from pathlib import Path
-from shutil import copy, rmtree
+from shutil import copyfile
 
 import pytest
 from cmem.cmempy.workspace.projects.project import delete_project, make_new_project
-from cmem.cmempy.workspace.projects.resources.resource import create_resource, get_resource
+from cmem.cmempy.workspace.projects.resources.resource import (
+    create_resource,
+    delete_resource,
+    get_resource,
+)
+from cmem_plugin_base.dataintegration.context import ExecutionContext, ReportContext
 from requests.exceptions import HTTPError
 
-from cmem_plugin_splitfile.plugin_splitfile import SplitFilePlugin
-from tests.utils import TestExecutionContext, needs_cmem
+from cmem_plugin_splitfile.plugin_splitfile import UPLOAD_WORKERS, SplitFilePlugin
+from tests.utils import (
+    TestExecutionContext,
+    TestTaskContext,
+    TestWorkflowContext,
+    needs_cmem,
+)
 
 from . import __path__
 
 UUID4 = "fc26980a17144b20ad8138d2493f0c2b"
-PROJECT_ID = f"project_{UUID4}"
 TEST_FILENAME = f"{UUID4}.nt"
-
-
-@pytest.fixture
-def setup(request: pytest.FixtureRequest) -> None:
-    """Set up Validate test"""
-    with suppress(Exception):
-        delete_project(PROJECT_ID)
-    make_new_project(PROJECT_ID)
-
-    (Path(__path__[0]) / PROJECT_ID / "resources").mkdir(parents=True, exist_ok=True)
-    copy(
-        Path(__path__[0]) / "test_files" / TEST_FILENAME,
-        Path(__path__[0]) / PROJECT_ID / "resources" / TEST_FILENAME,
-    )
-
-    with (Path(__path__[0]) / PROJECT_ID / "resources" / TEST_FILENAME).open("rb") as f:
-        buf = BytesIO(f.read())
+TEST_FILES = Path(__path__[0]) / "test_files"
+EMPTY_PROJECT_ID = f"project_{UUID4}_empty"
+PART_NAMES = [f"{UUID4}_00000000{n + 1}.nt" for n in range(3)]
+EXPECTED = {
+    prefix: [
+        (TEST_FILES / name.replace(UUID4, f"{UUID4}_{prefix}")).read_bytes() for name in PART_NAMES
+    ]
+    for prefix in ("size", "size_header", "lines", "lines_header")
+}
+
+
+def upload_input(project_id: str) -> None:
+    """Upload the test input file to the test project"""
+    with (TEST_FILES / TEST_FILENAME).open("rb") as f:
         create_resource(
-            project_name=PROJECT_ID,
+            project_name=project_id,
             resource_name=TEST_FILENAME,
-            file_resource=buf,
+            file_resource=f,
             replace=True,
         )
 
-    request.addfinalizer(lambda: rmtree(Path(__path__[0]) / PROJECT_ID))
-    request.addfinalizer(lambda: delete_project(PROJECT_ID))  # noqa: PT021
 
+@pytest.fixture(scope="session")
+def project_id(worker_id: str) -> str:
+    """Project ID of the pytest-xdist worker"""
+    return f"project_{UUID4}_{worker_id}"
 
-@needs_cmem
-@pytest.mark.usefixtures("setup")
-def test_filesystem_size() -> None:
-    """Test split by size using file system"""
-    SplitFilePlugin(
-        input_filename=TEST_FILENAME,
-        chunk_size=6,
-        size_unit="KB",
-        projects_path=__path__[0],
-        use_directory=True,
-    ).execute(None, context=TestExecutionContext(PROJECT_ID))
 
-    for n in range(3):
-        assert cmp(
-            Path(__path__[0]) / PROJECT_ID / "resources" / f"{UUID4}_00000000{n+1}.nt",
-            Path(__path__[0]) / "test_files" / f"{UUID4}_size_00000000{n+1}.nt",
-        )
+@pytest.fixture(scope="module")
+def context(project_id: str) -> TestExecutionContext:
+    """Create one execution context per module for the project of the worker"""
+    return TestExecutionContext(project_id)
 
-    if not (Path(__path__[0]) / PROJECT_ID / "resources" / TEST_FILENAME).is_file():
-        raise OSError("Input file deleted.")
 
+@pytest.fixture(scope="session")
+def project(project_id: str) -> Generator[None, None, None]:
+    """Create the test project of the worker once per session"""
+    with suppress(Exception):
+        delete_project(project_id)
+    make_new_project(project_id)
+    upload_input(project_id)
+    yield
+    delete_project(project_id)
 
-@needs_cmem
-@pytest.mark.usefixtures("setup")
-def test_filesystem_size_header() -> None:
-    """Test split by size with header using file system"""
-    SplitFilePlugin(
-        input_filename=TEST_FILENAME,
-        chunk_size=6,
-        size_unit="KB",
-        include_header=True,
-        projects_path=__path__[0],
-        use_directory=True,
-    ).execute(None, context=TestExecutionContext(PROJECT_ID))
 
-    for n in range(3):
-        assert cmp(
-            Path(__path__[0]) / PROJECT_ID / "resources" / f"{UUID4}_00000000{n+1}.nt",
-            Path(__path__[0]) / "test_files" / f"{UUID4}_size_header_00000000{n+1}.nt",
-        )
+@pytest.fixture
+def setup(
+    project_id: str,
+    tmp_path: Path,
+) -> Path:
+    """Set up a projects directory for a single test
+
+    Only the API tests need the CMEM project, so they request project_resources themselves.
+    """
+    resources_path = tmp_path / project_id / "resources"
+    resources_path.mkdir(parents=True)
+    # the plugin never writes to its input, so a hard link is as good as a copy
+    try:
+        (resources_path / TEST_FILENAME).hardlink_to(TEST_FILES / TEST_FILENAME)
+    except OSError:
+        copyfile(TEST_FILES / TEST_FILENAME, resources_path / TEST_FILENAME)
+    return tmp_path
+
+
+@pytest.fixture
+def project_resources(
+    request: pytest.FixtureRequest,
+    project_id: str,
+    project: None,  # noqa: ARG001
+) -> Generator[None, None, None]:
+    """Reset the resources of the shared test project after a single test"""
+    yield
+    # the project lives for the whole session, so parts uploaded by one test
+    # must not be mistaken for the results of the next one
+    for name in PART_NAMES:
+        with suppress(HTTPError):
+            delete_resource(project_id, name)
+    if request.node.get_closest_marker("mutates_input"):
+        upload_input(project_id)
+
+
+@pytest.fixture
+def empty_setup(tmp_path: Path) -> Path:
+    """Set up a projects directory with an empty input file, without a CMEM project"""
+    resources_path = tmp_path / EMPTY_PROJECT_ID / "resources"
+    resources_path.mkdir(parents=True)
+    (resources_path / TEST_FILENAME).touch()
+    return tmp_path
 
-    if not (Path(__path__[0]) / PROJECT_ID / "resources" / TEST_FILENAME).is_file():
-        raise OSError("Input file deleted.")
+
+def _compare_chunks(resources_path: Path, expected_prefix: str) -> None:
+    """Compare the split parts with the reference parts"""
+    for name, expected in zip(PART_NAMES, EXPECTED[expected_prefix], strict=True):
+        assert (resources_path / name).read_bytes() == expected
 
 
 @needs_cmem
-@pytest.mark.usefixtures("setup")
-def test_api_size() -> None:
-    """Test split by size using API"""
+@pytest.mark.parametrize(
+    ("size_unit", "chunk_size", "include_header", "delete_file", "expected_prefix"),
+    [
+        ("KB", 6, False, False, "size"),
+        ("KB", 6, True, False, "size_header"),
+        ("KB", 6, False, True, "size"),
+        ("Lines", 40, False, False, "lines"),
+        ("Lines", 40, True, False, "lines_header"),
+    ],
+)
+def test_filesystem(  # noqa: PLR0913
+    setup: Path,
+    project_id: str,
+    context: TestExecutionContext,
+    size_unit: str,
+    chunk_size: int,
+    include_header: bool,
+    delete_file: bool,
+    expected_prefix: str,
+) -> None:
+    """Test split using file system"""
     SplitFilePlugin(
         input_filename=TEST_FILENAME,
-        chunk_size=6,
-        size_unit="KB",
-        projects_path=__path__[0],
-    ).execute(None, context=TestExecutionContext(PROJECT_ID))
-
-    for n in range(3):
-        f = get_resource(project_name=PROJECT_ID, resource_name=f"{UUID4}_00000000{n+1}.nt")
-        assert (
-            f
-            == (Path(__path__[0]) / "test_files" / f"{UUID4}_size_00000000{n+1}.nt")
-            .open("rb")
-            .read()
-        )
+        chunk_size=chunk_size,
+        size_unit=size_unit,
+        include_header=include_header,
+        projects_path=str(setup),
+        use_directory=True,
+        delete_file=delete_file,
+    ).execute(None, context=context)
 
-    get_resource(project_name=PROJECT_ID, resource_name=TEST_FILENAME)
+    resources_path = setup / project_id / "resources"
+    _compare_chunks(resources_path, expected_prefix)
+    assert (resources_path / TEST_FILENAME).is_file() is not delete_file
 
 
 @needs_cmem
-@pytest.mark.usefixtures("setup")
-def test_filesystem_size_delete() -> None:
-    """Test split by size using file system and delete input file"""
+def test_filesystem_subdirectory_delete(
+    setup: Path, project_id: str, context: TestExecutionContext
+) -> None:
+    """Test split using file system and delete an input file located in a subdirectory"""
+    resources_path = setup / project_id / "resources"
+    (resources_path / "dir").mkdir()
+    (resources_path / TEST_FILENAME).rename(resources_path / "dir" / TEST_FILENAME)
     SplitFilePlugin(
-        input_filename=TEST_FILENAME,
+        input_filename=f"dir/{TEST_FILENAME}",
         chunk_size=6,
         size_unit="KB",
-        projects_path=__path__[0],
+        projects_path=str(setup),
         use_directory=True,
         delete_file=True,
-    ).execute(None, context=TestExecutionContext(PROJECT_ID))
-
-    for n in range(3):
-        assert cmp(
-            Path(__path__[0]) / PROJECT_ID / "resources" / f"{UUID4}_00000000{n+1}.nt",
-            Path(__path__[0]) / "test_files" / f"{UUID4}_size_00000000{n+1}.nt",
-        )
+    ).execute(None, context=context)
 
-    if (Path(__path__[0]) / PROJECT_ID / "resources" / TEST_FILENAME).is_file():
-        raise OSError("Input file not deleted.")
+    _compare_chunks(resources_path / "dir", "size")
+    assert not (resources_path / "dir" / TEST_FILENAME).exists()
 
 
 @needs_cmem
-@pytest.mark.usefixtures("setup")
-def test_api_size_delete() -> None:
-    """Test split by size using API and delete input file"""
+@pytest.mark.usefixtures("project_resources")
+@pytest.mark.parametrize(
+    "delete_file", [False, pytest.param(True, marks=pytest.mark.mutates_input)]
+)
+def test_api(
+    setup: Path,
+    project_id: str,
+    context: TestExecutionContext,
+    delete_file: bool,
+) -> None:
+    """Test split by size using API"""
     SplitFilePlugin(
         input_filename=TEST_FILENAME,
         chunk_size=6,
         size_unit="KB",
-        projects_path=__path__[0],
-        delete_file=True,
-    ).execute(None, context=TestExecutionContext(PROJECT_ID))
-
-    for n in range(3):
-        f = get_resource(project_name=PROJECT_ID, resource_name=f"{UUID4}_00000000{n+1}.nt")
-        assert (
-            f
-            == (Path(__path__[0]) / "test_files" / f"{UUID4}_size_00000000{n+1}.nt")
-            .open("rb")
-            .read()
-        )
+        projects_path=str(setup),
+        delete_file=delete_file,
+    ).execute(None, context=context)
 
-    try:
-        get_resource(project_name=PROJECT_ID, resource_name=TEST_FILENAME)
-    except Exception as exc:
-        if type(exc) is HTTPError and exc.response.status_code == 404:  # noqa: PLR2004
-            pass
-        else:
-            raise
+    with ThreadPoolExecutor(max_workers=len(PART_NAMES)) as executor:
+        assert list(executor.map(partial(get_resource, project_id), PART_NAMES)) == EXPECTED["size"]
+
+    if not delete_file:
+        get_resource(project_name=project_id, resource_name=TEST_FILENAME)
+        return
+    with pytest.raises(HTTPError) as exc:
+        get_resource(project_name=project_id, resource_name=TEST_FILENAME)
+    assert exc.value.response is not None
+    assert exc.value.response.status_code == 404  # noqa: PLR2004
 
 
 @needs_cmem
-@pytest.mark.usefixtures("setup")
-def test_filesystem_lines() -> None:
-    """Test split by lines using file system"""
+def test_filesystem_size_auto(setup: Path, project_id: str, context: TestExecutionContext) -> None:
+    """Test split by size with automatic chunk size using file system"""
     SplitFilePlugin(
         input_filename=TEST_FILENAME,
-        chunk_size=40,
-        size_unit="Lines",
-        projects_path=__path__[0],
+        chunk_size=6,
+        size_unit="KB",
+        projects_path=str(setup),
         use_directory=True,
-    ).execute(None, context=TestExecutionContext(PROJECT_ID))
+        auto_chunk_size=True,
+    ).execute(None, context=context)
 
-    for n in range(3):
-        assert cmp(
-            Path(__path__[0]) / PROJECT_ID / "resources" / f"{UUID4}_00000000{n+1}.nt",
-            Path(__path__[0]) / "test_files" / f"{UUID4}_lines_00000000{n+1}.nt",
-        )
+    resources_path = setup / project_id / "resources"
+    assert (resources_path / PART_NAMES[0]).read_bytes() == (
+        TEST_FILES / TEST_FILENAME
+    ).read_bytes()
+    assert not (resources_path / PART_NAMES[1]).exists()
 
 
 @needs_cmem
-@pytest.mark.usefixtures("setup")
-def test_filesystem_lines_header() -> None:
-    """Test split by lines with header using file system"""
+@pytest.mark.parametrize("delete_file", [False, True])
+def test_filesystem_empty_file(empty_setup: Path, delete_file: bool) -> None:
+    """Test that an empty input file results in one empty part using file system"""
     SplitFilePlugin(
         input_filename=TEST_FILENAME,
-        chunk_size=40,
-        size_unit="Lines",
-        include_header=True,
-        projects_path=__path__[0],
+        chunk_size=6,
+        size_unit="KB",
+        projects_path=str(empty_setup),
         use_directory=True,
-    ).execute(None, context=TestExecutionContext(PROJECT_ID))
-
-    for n in range(3):
-        assert cmp(
-            Path(__path__[0]) / PROJECT_ID / "resources" / f"{UUID4}_00000000{n+1}.nt",
-            Path(__path__[0]) / "test_files" / f"{UUID4}_lines_header_00000000{n+1}.nt",
-        )
+        delete_file=delete_file,
+    ).execute(None, context=TestExecutionContext(EMPTY_PROJECT_ID))
+
+    resources_path = empty_setup / EMPTY_PROJECT_ID / "resources"
+    assert (resources_path / PART_NAMES[0]).stat().st_size == 0
+    assert not (resources_path / PART_NAMES[1]).exists()
+    assert (resources_path / TEST_FILENAME).is_file() is not delete_file
+
+
+class UploadStubPlugin(SplitFilePlugin):
+    """Plugin with stubbed download, split and upload, for tests of the upload loop"""
+
+    def __init__(self, failing_part: Path | None = None) -> None:
+        super().__init__(input_filename=TEST_FILENAME, chunk_size=6, size_unit="KB")
+        self.failing_part = failing_part
+        self.uploaded: list[Path] = []
+
+    def get_file(self, file_path: Path) -> None:
+        """Create an empty input file"""
+        file_path.touch()
+
+    def split_file(self, input_file_path: Path, keep_input: bool = True) -> None:  # noqa: ARG002
+        """Pretend to split the input into ten parts"""
+        self.split_filenames = [Path(f"part_{n}") for n in range(10)]
+
+    def upload_file(self, part_path: Path) -> None:
+        """Record the upload, or fail for the failing part"""
+        if part_path == self.failing_part:
+            raise OSError("Upload failed.")
+        time.sleep(0.05)
+        self.uploaded.append(part_path)
+
+
+class OfflineExecutionContext(ExecutionContext):
+    """Execution context without a CMEM user, cancelled after a number of status checks"""
+
+    def __init__(self, running_checks: int):
+        self.report = ReportContext()
+        self.task = TestTaskContext(project_id=EMPTY_PROJECT_ID)
+        self.user = None
+        self.workflow = TestWorkflowContext()
+        checks = count(1)
+        self.workflow.status = lambda: "Running" if next(checks) <= running_checks else "Canceling"
+
+
+@pytest.mark.parametrize(("running_checks", "uploads"), [(2, 0), (5, 3), (100, 10)])
+def test_api_upload_cancel(running_checks: int, uploads: int) -> None:
+    """Test that no part is uploaded after the workflow was cancelled"""
+    # the status is checked before and after the download, then before each upload
+    plugin = UploadStubPlugin()
+    plugin.execute(None, context=OfflineExecutionContext(running_checks))
+    assert len(plugin.uploaded) == uploads
+    assert plugin.moved_files == uploads
+
+
+def test_api_upload_failure() -> None:
+    """Test that the uploads stop at the first failed upload"""
+    plugin = UploadStubPlugin(failing_part=Path("part_0"))
+    with pytest.raises(OSError, match="Upload failed"):
+        plugin.execute(None, context=OfflineExecutionContext(100))
+    # only the uploads running next to the failed one are finished, and they are counted
+    assert len(plugin.uploaded) == UPLOAD_WORKERS - 1
+    assert plugin.moved_files == UPLOAD_WORKERS - 1
+
+
+@pytest.mark.parametrize(
+    ("kwargs", "match"),
+    [
+        ({"size_unit": "MB", "chunk_size": 0.0004}, "Minimum chunk size is 1024 bytes"),
+        ({"size_unit": "Lines", "chunk_size": 1.5}, "Invalid chunk size"),
+        ({"size_unit": "Lines", "chunk_size": 0}, "Invalid chunk size"),
+        (
+            {"input_filename": "", "chunk_size": 1},
+            'Invalid filename for parameter "Input filename"',
+        ),
+        (
+            {"chunk_size": 1, "use_directory": True, "projects_path": "a\0b"},
+            'Invalid path for parameter "Internal projects directory"',
+        ),
+        (
+            {"chunk_size": 1, "use_directory": True, "projects_path": "/nonexistent_directory"},
+            "Directory /nonexistent_directory does not exist",
+        ),
+    ],
+)
+def test_parameter_validation(kwargs: dict, match: str) -> None:
+    """Test that invalid parameters raise a ValueError"""
+    with pytest.raises(ValueError, match=match):
+        SplitFilePlugin(**{"input_filename": "file", **kwargs})
+
+
+@pytest.mark.parametrize(
+    ("size_unit", "chunk_size", "size", "lines"),
+    [
+        ("KB", 1, 1024, False),
+        ("MB", 0.5, 524288, False),
+        ("GB", 1, 1073741824, False),
+        ("Lines", 1, 1, True),
+    ],
+)
+def test_parameter_chunk_size(size_unit: str, chunk_size: float, size: int, lines: bool) -> None:
+    """Test the conversion of the chunk size to bytes or lines"""
+    plugin = SplitFilePlugin(input_filename="file", chunk_size=chunk_size, size_unit=size_unit)
+    assert plugin.size == size
+    assert plugin.lines is lines
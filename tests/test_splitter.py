@@ -0,0 +1,119 @@
+"""Splitter tests."""
+
+import os
+from filecmp import cmp
+from pathlib import Path
+
+import pytest
+
+from cmem_plugin_splitfile import splitter, utils
+from cmem_plugin_splitfile.splitter import Splitter
+
+from . import __path__
+
+UUID4 = "fc26980a17144b20ad8138d2493f0c2b"
+TEST_FILENAME = f"{UUID4}.nt"
+
+
+@pytest.mark.parametrize(("include_header", "reference"), [(False, "size"), (True, "size_header")])
+def test_bysize(tmp_path: Path, include_header: bool, reference: str) -> None:
+    """Test split by size against the reference files"""
+    splits: list[tuple[str, int]] = []
+    Splitter(inputfile=Path(__path__[0]) / "test_files" / TEST_FILENAME, outputdir=tmp_path).bysize(
+        size=6144,
+        includeheader=include_header,
+        callback=lambda path, size: splits.append((path, size)),
+    )
+
+    assert len(splits) == 3  # noqa: PLR2004
+    for n, (path, size) in enumerate(splits):
+        assert path == str(tmp_path / f"{UUID4}_00000000{n + 1}.nt")
+        assert size == Path(path).stat().st_size
+        assert cmp(
+            path,
+            Path(__path__[0]) / "test_files" / f"{UUID4}_{reference}_00000000{n + 1}.nt",
+            shallow=False,
+        )
+
+
+def test_bysize_without_pread(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test split by size with the seek/read/write copy fallback, as on Windows"""
+    for name in ("copy_file_range", "sendfile", "preadv"):
+        monkeypatch.delattr(os, name, raising=False)
+    shared_fds: list[int] = []
+    copy_fds: list[int] = []
+
+    def copy_range(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+        copy_fds.append(src_fd)
+        utils.copy_range(src_fd, dst_fd, offset, count)
+
+    monkeypatch.setattr(splitter, "advise_sequential", shared_fds.append)
+    monkeypatch.setattr(splitter, "copy_range", copy_range)
+    Splitter(inputfile=Path(__path__[0]) / "test_files" / TEST_FILENAME, outputdir=tmp_path).bysize(
+        size=6144, includeheader=True
+    )
+
+    # the fallback moves the file position, so the parts must not share the input fd
+    assert len(copy_fds) == 3  # noqa: PLR2004
+    assert shared_fds[0] not in copy_fds
+    for n in range(3):
+        assert cmp(
+            tmp_path / f"{UUID4}_00000000{n + 1}.nt",
+            Path(__path__[0]) / "test_files" / f"{UUID4}_size_header_00000000{n + 1}.nt",
+            shallow=False,
+        )
+
+
+@pytest.mark.parametrize(
+    ("include_header", "reference"), [(False, "lines"), (True, "lines_header")]
+)
+def test_bylinecount(tmp_path: Path, include_header: bool, reference: str) -> None:
+    """Test split by lines against the reference files"""
+    Splitter(
+        inputfile=Path(__path__[0]) / "test_files" / TEST_FILENAME, outputdir=tmp_path
+    ).bylinecount(linecount=40, includeheader=include_header)
+
+    assert len(list(tmp_path.iterdir())) == 3  # noqa: PLR2004
+    for n in range(3):
+        assert cmp(
+            tmp_path / f"{UUID4}_00000000{n + 1}.nt",
+            Path(__path__[0]) / "test_files" / f"{UUID4}_{reference}_00000000{n + 1}.nt",
+            shallow=False,
+        )
+
+
+def test_bysize_long_line(tmp_path: Path) -> None:
+    """Test that a line longer than the size limit is written to a split of its own"""
+    input_file = tmp_path / "input.txt"
+    input_file.write_bytes(b"a\n" + b"b" * 3000 + b"\nc\n")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    Splitter(inputfile=input_file, outputdir=output_dir).bysize(size=1024)
+
+    assert sorted(p.read_bytes() for p in output_dir.iterdir()) == [
+        b"a\n",
+        b"b" * 3000 + b"\n",
+        b"c\n",
+    ]
+
+
+def test_bysize_empty(tmp_path: Path) -> None:
+    """Test that an empty file results in one empty split"""
+    input_file = tmp_path / "input.txt"
+    input_file.touch()
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    Splitter(inputfile=input_file, outputdir=output_dir).bysize(size=1024, includeheader=True)
+
+    assert (output_dir / "input_000000001.txt").read_bytes() == b""
+
+
+def test_bysize_link_single_part(tmp_path: Path) -> None:
+    """Test that an input file fitting into one split is hard linked"""
+    input_file = tmp_path / "input.txt"
+    input_file.write_bytes(b"a\nb\n")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    Splitter(inputfile=input_file, outputdir=output_dir).bysize(size=1024, link_single_part=True)
+
+    assert (output_dir / "input_000000001.txt").stat().st_ino == input_file.stat().st_ino
@@ -0,0 +1,117 @@
+"""Utils tests."""
+
+import os
+from errno import EACCES, EINVAL, EXDEV
+from pathlib import Path
+from typing import NoReturn
+
+import pytest
+
+from cmem_plugin_splitfile import utils
+
+HEADER = b"header line\n"
+DATA = os.urandom(3 * utils.COPY_BUFFER_SIZE + 12345)
+OFFSET = 4321
+
+
+def _raise(errno: int) -> NoReturn:
+    raise OSError(errno, os.strerror(errno))
+
+
+def _copy(tmp_path: Path) -> bytes:
+    """Copy DATA from OFFSET to a destination file that already contains a header"""
+    src = tmp_path / "src"
+    src.write_bytes(DATA)
+    dst = tmp_path / "dst"
+    src_fd = os.open(src, os.O_RDONLY)
+    dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(dst_fd, HEADER)
+        utils.copy_range(src_fd, dst_fd, OFFSET, len(DATA) - OFFSET)
+    finally:
+        os.close(dst_fd)
+        os.close(src_fd)
+    return dst.read_bytes()
+
+
+def test_copy_range(tmp_path: Path) -> None:
+    """Test copying a byte range with the default copy function"""
+    assert _copy(tmp_path) == HEADER + DATA[OFFSET:]
+
+
+@pytest.mark.parametrize("errno", [EXDEV, EINVAL])
+def test_copy_range_sendfile(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, errno: int) -> None:
+    """Test the fallback to sendfile if copy_file_range is not supported"""
+    if not hasattr(os, "sendfile"):
+        pytest.skip("sendfile is not available")
+    calls: list[int] = []
+
+    def sendfile(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+        calls.append(count)
+        return utils_sendfile(src_fd, dst_fd, offset, count)
+
+    utils_sendfile = utils._sendfile  # noqa: SLF001
+    monkeypatch.setattr(utils, "_copy_file_range", lambda *_: _raise(errno))
+    monkeypatch.setattr(utils, "_sendfile", sendfile)
+    assert _copy(tmp_path) == HEADER + DATA[OFFSET:]
+    assert calls
+
+
+@pytest.mark.parametrize("errno", [EXDEV, EINVAL])
+def test_copy_range_pread_write(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, errno: int
+) -> None:
+    """Test the fallback to pread/write over several blocks, reusing the buffer"""
+    calls: list[int] = []
+
+    def pread_write(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+        calls.append(count)
+        return utils_pread_write(src_fd, dst_fd, offset, count)
+
+    utils_pread_write = utils._pread_write  # noqa: SLF001
+    monkeypatch.setattr(utils, "_copy_file_range", lambda *_: _raise(errno))
+    monkeypatch.setattr(utils, "_sendfile", lambda *_: _raise(errno))
+    monkeypatch.setattr(utils, "_pread_write", pread_write)
+    assert _copy(tmp_path) == HEADER + DATA[OFFSET:]
+    assert len(calls) > 1
+    # a second copy in the same thread reuses the buffer of the first one
+    buffer = utils._copy_buffers.buffer  # noqa: SLF001
+    assert _copy(tmp_path) == HEADER + DATA[OFFSET:]
+    assert utils._copy_buffers.buffer is buffer  # noqa: SLF001
+
+
+def test_copy_range_seek_read_write(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test the fallback to seek/read/write if neither kernel-side copies nor pread exist"""
+    calls: list[int] = []
+
+    def seek_read_write(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+        calls.append(count)
+        return utils_seek_read_write(src_fd, dst_fd, offset, count)
+
+    utils_seek_read_write = utils._seek_read_write  # noqa: SLF001
+    for name in ("copy_file_range", "sendfile", "preadv"):
+        monkeypatch.delattr(os, name, raising=False)
+    monkeypatch.setattr(utils, "_seek_read_write", seek_read_write)
+    assert not utils.has_positional_read()
+    assert _copy(tmp_path) == HEADER + DATA[OFFSET:]
+    assert len(calls) > 1
+
+
+def test_copy_range_error(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that errors other than unsupported copy functions are raised"""
+    monkeypatch.setattr(utils, "_copy_file_range", lambda *_: _raise(EACCES))
+    with pytest.raises(PermissionError):
+        _copy(tmp_path)
+
+
+def test_move_file_cross_device(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test moving a file to another filesystem, replacing an existing destination file"""
+    src = tmp_path / "src"
+    src.write_bytes(DATA)
+    dst = tmp_path / "dst"
+    # a longer destination file must be truncated
+    dst.write_bytes(DATA + HEADER)
+    monkeypatch.setattr(Path, "replace", lambda *_: _raise(EXDEV))
+    utils.move_file(src, dst)
+    assert dst.read_bytes() == DATA
+    assert not src.exists()